@@ -0,0 +1,85 @@
+import collections
+import random
+import unittest
+
+from kalliope.trigger.snowboy.snowboydecoder import RingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.ring_buffer = RingBuffer(size=10)
+
+    def test_extend_and_get(self):
+        self.ring_buffer.extend(b'abc')
+        self.ring_buffer.extend(b'defgh')
+
+        self.assertEqual(8, len(self.ring_buffer))
+        self.assertEqual(b'abcdefgh', self.ring_buffer.get())
+
+    def test_get_clears_the_buffer(self):
+        self.ring_buffer.extend(b'abc')
+        self.ring_buffer.get()
+
+        self.assertEqual(0, len(self.ring_buffer))
+        self.assertEqual(b'', self.ring_buffer.get())
+
+    def test_extend_empty_data(self):
+        self.ring_buffer.extend(b'')
+
+        self.assertEqual(0, len(self.ring_buffer))
+
+    def test_overflow_drops_oldest_bytes(self):
+        self.ring_buffer.extend(b'0123456789')
+        self.ring_buffer.extend(b'abc')
+
+        self.assertEqual(10, len(self.ring_buffer))
+        self.assertEqual(b'3456789abc', self.ring_buffer.get())
+
+    def test_extend_wraps_around_the_backing_store(self):
+        # consume some bytes so the write index is in the middle, then force
+        # the next chunk to wrap past the end of the backing store
+        self.ring_buffer.extend(b'01234567')
+        self.ring_buffer.get()
+        self.ring_buffer.extend(b'abcde')
+        self.ring_buffer.extend(b'fghij')
+
+        self.assertEqual(b'abcdefghij', self.ring_buffer.get())
+
+    def test_chunk_larger_than_capacity_keeps_most_recent_bytes(self):
+        self.ring_buffer.extend(b'0123456789ABC')
+
+        self.assertEqual(10, len(self.ring_buffer))
+        self.assertEqual(b'3456789ABC', self.ring_buffer.get())
+
+    def test_pause_and_unpause(self):
+        self.ring_buffer.pause()
+        self.ring_buffer.extend(b'abc')
+
+        self.assertEqual(0, len(self.ring_buffer))
+
+        self.ring_buffer.unpause()
+        self.ring_buffer.extend(b'abc')
+
+        self.assertEqual(b'abc', self.ring_buffer.get())
+
+    def test_random_chunks_match_a_deque_model(self):
+        # the buffer must behave like a deque(maxlen=size) of bytes for any
+        # interleaving of extends and gets
+        random.seed(42)
+        size = 32
+        ring_buffer = RingBuffer(size=size)
+        model = collections.deque(maxlen=size)
+        for _ in range(500):
+            chunk = bytes(random.randrange(256)
+                          for _ in range(random.randrange(0, 3 * size)))
+            ring_buffer.extend(chunk)
+            model.extend(chunk)
+            self.assertEqual(len(model), len(ring_buffer))
+            if random.random() < 0.3:
+                self.assertEqual(bytes(bytearray(model)), ring_buffer.get())
+                model.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
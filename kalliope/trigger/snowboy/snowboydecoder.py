@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-import collections
+import asyncio
+import functools
+import queue
+import threading
 from threading import Thread
 
 import pyaudio
@@ -14,26 +17,107 @@ TOP_DIR = os.path.dirname(os.path.abspath(__file__))
 
 RESOURCE_FILE = os.path.join(TOP_DIR, "resources/common.res")
 
+
+def _noop():
+    """Placeholder for missing detection callbacks"""
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _encode_sensitivity(sensitivity):
+    """Encode a tuple of sensitivities for SnowboyDetect.SetSensitivity.
+    Cached so harnesses recreating detectors with the same settings skip
+    the float->str conversion."""
+    return ",".join(map(str, sensitivity)).encode()
+
+try:
+    import numpy as np
+    from numba import njit
+
+    # no explicit signature: the chunks come out of RingBuffer.get() as
+    # bytes, so frombuffer yields read-only arrays, which an eager
+    # int16[:] signature would reject
+    @njit(cache=True, fastmath=True)
+    def _rms_i16(buf):
+        s = 0.0
+        for x in buf:
+            s += x * x
+        return (s / buf.size) ** 0.5
+except ImportError:
+    # numpy/numba are optional, without them silence gating is disabled
+    np = None
+    _rms_i16 = None
+
 class SnowboyOpenAudioException(Exception):
     pass
 
 
 class RingBuffer(object):
-    """Ring buffer to hold audio from PortAudio"""
-    def __init__(self, size = 4096):
-        self._buf = collections.deque(maxlen=size)
+    """
+    Ring buffer to hold audio from PortAudio.
+
+    The audio is kept in a preallocated bytearray with head/tail indices so
+    that every incoming chunk is stored with a single slice assignment instead
+    of one deque append per byte. When the buffer is full the oldest bytes are
+    dropped, like a deque with maxlen would do.
+
+    :param size: buffer capacity in bytes
+    """
+    def __init__(self, size=4096):
+        self._size = size
+        self._buf = bytearray(size)
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+        self._lock = threading.Lock()
         self.paused = False
 
+    def __len__(self):
+        return self._count
+
     def extend(self, data):
-        """Adds data to the end of buffer"""
-        if not self.paused:
-            self._buf.extend(data)
+        """Adds data to the end of buffer with a single contiguous copy"""
+        if self.paused:
+            return
+        n = len(data)
+        if n == 0:
+            return
+        with self._lock:
+            if n >= self._size:
+                # the chunk alone fills the buffer, keep its most recent bytes
+                self._buf[:] = data[-self._size:]
+                self._head = self._tail = 0
+                self._count = self._size
+                return
+            # drop the oldest bytes when the chunk does not fit
+            overflow = self._count + n - self._size
+            if overflow > 0:
+                self._head = (self._head + overflow) % self._size
+                self._count -= overflow
+            end = self._tail + n
+            if end <= self._size:
+                self._buf[self._tail:end] = data
+            else:
+                cut = self._size - self._tail
+                self._buf[self._tail:] = data[:cut]
+                self._buf[:n - cut] = data[cut:]
+            self._tail = end % self._size
+            self._count += n
 
     def get(self):
         """Retrieves data from the beginning of buffer and clears it"""
-        tmp = bytes(bytearray(self._buf))
-        self._buf.clear()
-        return tmp
+        with self._lock:
+            if self._count == 0:
+                return b""
+            end = self._head + self._count
+            if end <= self._size:
+                tmp = bytes(memoryview(self._buf)[self._head:end])
+            else:
+                tmp = bytes(memoryview(self._buf)[self._head:]) + \
+                      bytes(memoryview(self._buf)[:end - self._size])
+            self._head = self._tail = 0
+            self._count = 0
+            return tmp
 
     def pause(self):
         self.paused = True
@@ -54,88 +138,183 @@ class HotwordDetector(Thread):
                               default sensitivity in the model will be used.
     :param audio_gain: multiply input volume by this factor.
     :param apply_frontend: applies the frontend processing algorithm if True.
+    :param silence_threshold: RMS level (int16 scale) below which a chunk is
+                              considered silence and skipped before reaching
+                              the detector. 0 disables the gate; it also
+                              stays disabled when numpy/numba are missing.
+    :param frames_per_buffer: PortAudio buffer size in frames. Defaults to
+                              100 ms of audio, which keeps the callback rate
+                              low; added latency is bounded by one buffer.
     """
-    def __init__(self, 
-                 decoder_model, 
-                 resource=RESOURCE_FILE, 
-                 sensitivity=[], 
+    def __init__(self,
+                 decoder_model,
+                 resource=RESOURCE_FILE,
+                 sensitivity=[],
                  audio_gain=1,
                  apply_frontend=False,
                  detected_callback=None,
-                 interrupt_check=lambda: False):
+                 interrupt_check=lambda: False,
+                 silence_threshold=0,
+                 frames_per_buffer=None):
 
         super(HotwordDetector, self).__init__()
-        self.detected_callback = detected_callback
         self.interrupt_check = interrupt_check
         self.sleep_time = 0.03
         self.kill_received = False
         self.paused = False
+        self.silence_threshold = silence_threshold
 
         def audio_callback(in_data, frame_count, time_info, status):
             self.ring_buffer.extend(in_data)
-            play_data = chr(0) * len(in_data)
-            return play_data, pyaudio.paContinue
-
-        tm = type(decoder_model)
-        ts = type(sensitivity)
-        if tm is not list:
+            # wake up the detection thread as soon as one detector frame
+            # worth of audio is available instead of letting it poll
+            if len(self.ring_buffer) >= self._min_bytes:
+                with self._data_ready:
+                    self._data_ready.notify()
+            # the stream is opened with output=False, so PortAudio ignores
+            # the output buffer; no need to hand back silence
+            return None, pyaudio.paContinue
+
+        if not isinstance(decoder_model, (list, tuple)):
             decoder_model = [decoder_model]
-        if ts is not list:
+        if not isinstance(sensitivity, (list, tuple)):
             sensitivity = [sensitivity]
+        sensitivity = list(sensitivity)
         model_str = ",".join(decoder_model)
 
         self.detector = snowboydetect.SnowboyDetect(
             resource_filename=resource.encode(), model_str=model_str.encode())
         self.detector.SetAudioGain(audio_gain)
         self.detector.ApplyFrontend(apply_frontend)
+        # cache the stream format once, every query is a SWIG call into C++
         self.num_hotwords = self.detector.NumHotwords()
+        self._channels = self.detector.NumChannels()
+        self._sample_rate = self.detector.SampleRate()
+        self._sample_width = self.detector.BitsPerSample() // 8
+
+        # normalize the callbacks once here instead of on every start();
+        # the tuple is immutable so a restarted Thread cannot re-wrap it
+        if not isinstance(detected_callback, (list, tuple)):
+            detected_callback = [detected_callback]
+        if len(detected_callback) == 1 and self.num_hotwords > 1:
+            detected_callback = list(detected_callback) * self.num_hotwords
+        assert self.num_hotwords == len(detected_callback), \
+            "Error: hotwords in your models (%d) do not match the number of " \
+            "callbacks (%d)" % (self.num_hotwords, len(detected_callback))
+        # missing callbacks become no-ops so the detection dispatch needs
+        # no None check
+        self._callbacks = tuple(cb or _noop for cb in detected_callback)
         
         if len(sensitivity) > self.num_hotwords:            # If more sensitivities available as hotwords, it will raise an AssertionError
             assert self.num_hotwords == len(sensitivity), \
                 "number of hotwords in decoder_model (%d) and sensitivity " \
                 "(%d) does not match" % (self.num_hotwords, len(sensitivity))
 
-        if len(sensitivity) != self.num_hotwords:           # Some umdl model contains more then one keyword.
-            sensitivity_match_hotwords = False             # If the user sets only one sensitivity, we add for the second model a default sensitivity of 0.5
-            while not sensitivity_match_hotwords:
-                sensitivity.append(0.5)
-                if len(sensitivity) == self.num_hotwords:
-                    sensitivity_match_hotwords = True
-        
-        if len(decoder_model) > 1 and len(sensitivity) == 1:
-            sensitivity = sensitivity*self.num_hotwords
+        # Some umdl model contains more then one keyword. If the user sets
+        # fewer sensitivities than hotwords, pad with a default of 0.5 in one
+        # extend instead of appending one value at a time.
+        need = self.num_hotwords - len(sensitivity)
+        if need > 0:
+            sensitivity.extend([0.5] * need)
 
-        sensitivity_str = ",".join([str(t) for t in sensitivity])
         if len(sensitivity) != 0:
-            self.detector.SetSensitivity(sensitivity_str.encode())
-
+            set_array = getattr(self.detector, "SetSensitivityArray", None)
+            if set_array is not None and np is not None:
+                # newer bindings take the floats directly, skipping the
+                # comma-separated string parsed back on the C++ side
+                set_array(np.asarray(sensitivity, dtype=np.float32))
+            else:
+                self.detector.SetSensitivity(
+                    _encode_sensitivity(tuple(sensitivity)))
+
+        if frames_per_buffer is None:
+            # 100 ms of audio per callback: Snowboy consumes 10/30 ms frames
+            # internally, so larger chunks only cut the Python<->C crossing
+            # rate without hurting detection latency
+            frames_per_buffer = int(self._sample_rate * 0.1)
+        self.frames_per_buffer = frames_per_buffer
+
+        # audio_callback notifies this condition once ~100 ms of audio is
+        # buffered, so the drain thread wakes up right away instead of on
+        # its next poll
+        self._data_ready = threading.Condition()
+        # bounded handoff between the buffer-drain stage and the detection
+        # loop; a slow interrupt_check or callback can no longer stall the
+        # drain, the oldest chunk is dropped instead
+        self._detect_queue = queue.Queue(maxsize=8)
+        self._feature_thread = None
+        # set when detection runs on an asyncio loop via run_in_event_loop
+        # instead of the dedicated thread
+        self._loop = None
+        self._async_event = None
+        self._min_bytes = int(self._sample_rate * self._channels *
+                              self._sample_width * 0.1)
+
+        # capacity is in bytes, so the sample width must be part of the
+        # sizing: 5 seconds of audio whatever the stream format
         self.ring_buffer = RingBuffer(
-            self.detector.NumChannels() * self.detector.SampleRate() * 5)
+            self._channels * self._sample_rate * self._sample_width * 5)
         self.audio = pyaudio.PyAudio()
         self.open_audio(audio_callback)
 
-    def open_audio(self, audio_callback, i=0):
-        try:
-            self.stream_in = self.audio.open(
-                input=True, output=False,
-                format=self.audio.get_format_from_width(
-                    self.detector.BitsPerSample() / 8),
-                channels=self.detector.NumChannels(),
-                rate=self.detector.SampleRate(),
-                frames_per_buffer=2048,
-                stream_callback=audio_callback)
-        except IOError as error:
-            logger.debug("IOError raised, i = %s (error: %s)"
-                         % (i, repr(error)))
-            if i == 5:
-                # Let's give up...
-                raise SnowboyOpenAudioException(
-                    'Error while trying to open audio: %',
-                    repr(error))
-
-            i = i + 1
-            time.sleep(i)
-            self.open_audio(audio_callback, i)
+    def open_audio(self, audio_callback):
+        delay = 0.1
+        for attempt in range(6):
+            try:
+                self.stream_in = self.audio.open(
+                    input=True, output=False,
+                    format=self.audio.get_format_from_width(
+                        self._sample_width),
+                    channels=self._channels,
+                    rate=self._sample_rate,
+                    frames_per_buffer=self.frames_per_buffer,
+                    stream_callback=audio_callback)
+                return
+            except IOError as error:
+                logger.debug("IOError raised, attempt = %s (error: %s)"
+                             % (attempt, repr(error)))
+                if attempt == 5:
+                    # Let's give up...
+                    raise SnowboyOpenAudioException(
+                        'Error while trying to open audio: %s' % repr(error))
+                time.sleep(delay)
+                delay *= 2
+
+    def _feature_loop(self):
+        """
+        Drain the ring buffer on a dedicated thread and hand owned audio
+        chunks to the detection loop through `_detect_queue`. The chunks are
+        plain bytes snapshots so they stay valid across the thread handoff.
+        """
+        while not self.kill_received:
+            data = self.ring_buffer.get()
+            if len(data) == 0:
+                with self._data_ready:
+                    self._data_ready.wait(timeout=self.sleep_time)
+                continue
+            if self.silence_threshold and _rms_i16 is not None:
+                # skip the DNN eval entirely while the microphone is silent
+                try:
+                    samples = np.frombuffer(data, dtype=np.int16)
+                    if _rms_i16(samples) < self.silence_threshold:
+                        continue
+                except Exception as error:
+                    # degrade to no gating rather than killing the drain
+                    # thread and silently stopping detection
+                    logger.warning("Silence gate disabled after error: %s"
+                                   % repr(error))
+                    self.silence_threshold = 0
+            try:
+                self._detect_queue.put_nowait(data)
+            except queue.Full:
+                # detection is lagging, drop the oldest chunk
+                try:
+                    self._detect_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._detect_queue.put_nowait(data)
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._async_event.set)
 
     def run(self):
         """
@@ -158,48 +337,131 @@ class HotwordDetector(Thread):
             logger.debug("detect voice return")
             return
 
-        tc = type(self.detected_callback)
-        if tc is not list:
-            self.detected_callback = [self.detected_callback]
-        if len(self.detected_callback) == 1 and self.num_hotwords > 1:
-            self.detected_callback *= self.num_hotwords
+        logger.debug("detecting...")
 
-        assert self.num_hotwords == len(self.detected_callback), \
-            "Error: hotwords in your models (%d) do not match the number of " \
-            "callbacks (%d)" % (self.num_hotwords, len(self.detected_callback))
+        # pre-bind the hot-loop lookups to locals; kill_received and paused
+        # stay attribute reads because other threads mutate them
+        interrupt = self.interrupt_check
+        queue_get = self._detect_queue.get
+        detect_chunk = self._detect_chunk
+        sleep_time = self.sleep_time
 
-        logger.debug("detecting...")
+        self._feature_thread = threading.Thread(target=self._feature_loop,
+                                                daemon=True)
+        self._feature_thread.start()
+        try:
+            # favour the detection loop over best-effort threads when the
+            # process is allowed to renice itself
+            os.nice(-5)
+        except (AttributeError, OSError):
+            pass
 
         while not self.kill_received:
             if not self.paused:
-                if self.interrupt_check():
+                if interrupt():
                     logger.debug("detect voice break")
                     break
-                data = self.ring_buffer.get()
-                if len(data) == 0:
-                    time.sleep(self.sleep_time)
+                try:
+                    # the timeout keeps the interrupt check running while
+                    # the microphone is silent
+                    data = queue_get(timeout=sleep_time)
+                except queue.Empty:
                     continue
 
-                ans = self.detector.RunDetection(data)
-                if ans == -1:
-                    logger.warning("Error initializing streams or reading audio data")
-                elif ans > 0: 
-                    message = "Keyword %s detected" % ans
-                    logger.debug(message)
-                    callback = self.detected_callback[ans-1]
-                    if callback is not None:
-                        callback()
+                detect_chunk(data)
             else:
                 # take a little break
-                time.sleep(self.sleep_time)
+                time.sleep(sleep_time)
 
+        self._stop_feature_thread()
         logger.debug("[Snowboy] process finished.")
 
+    def _detect_chunk(self, data):
+        """Run one buffered audio chunk through the detector and fire the
+        matching callback"""
+        # NOTE: the prebuilt _snowboydetect bindings shipped per
+        # architecture were generated without SWIG's -threads mode, so
+        # RunDetection holds the GIL for the whole DNN eval. The ring
+        # buffer keeps its lock scope down to a slice copy so
+        # audio_callback only ever blocks for microseconds; rebuild the
+        # bindings with %thread on RunDetection to let the callback run
+        # fully in parallel.
+        ans = self.detector.RunDetection(data)
+        if ans == -1:
+            logger.warning("Error initializing streams or reading audio data")
+        elif ans > 0:
+            logger.debug("Keyword %s detected" % ans)
+            self._callbacks[ans-1]()
+
+    def run_in_event_loop(self, loop):
+        """
+        Schedule the detection loop as a task on `loop` instead of starting
+        the thread, so several detectors can share one event loop rather
+        than paying an OS thread each. Must be called from the loop's own
+        thread. RunDetection itself still blocks the loop for the duration
+        of one DNN eval.
+
+        :param loop: the asyncio event loop to run on.
+        :return: the created asyncio task.
+        """
+        self._loop = loop
+        self._async_event = asyncio.Event()
+        self._feature_thread = threading.Thread(target=self._feature_loop,
+                                                daemon=True)
+        self._feature_thread.start()
+        return loop.create_task(self._run_async())
+
+    async def _run_async(self):
+        """Coroutine twin of run(), woken by the drain thread through
+        `_async_event` instead of a blocking queue get"""
+        if self.interrupt_check():
+            logger.debug("detect voice return")
+            return
+
+        logger.debug("detecting...")
+
+        while not self.kill_received:
+            if self.paused:
+                # take a little break
+                await asyncio.sleep(self.sleep_time)
+                continue
+            if self.interrupt_check():
+                logger.debug("detect voice break")
+                break
+            try:
+                data = self._detect_queue.get_nowait()
+            except queue.Empty:
+                # the timeout keeps the interrupt check running while
+                # the microphone is silent
+                try:
+                    await asyncio.wait_for(self._async_event.wait(),
+                                           timeout=self.sleep_time)
+                except asyncio.TimeoutError:
+                    pass
+                self._async_event.clear()
+                continue
+            self._detect_chunk(data)
+
+        self._stop_feature_thread()
+        logger.debug("[Snowboy] process finished.")
+
+    def _stop_feature_thread(self):
+        """
+        Stop the buffer-drain thread. kill_received also ends the detection
+        loops, which is fine: this runs when they exit or on terminate().
+        """
+        self.kill_received = True
+        # wake the drain thread so it notices right away instead of on its
+        # next timeout
+        with self._data_ready:
+            self._data_ready.notify_all()
+
     def terminate(self):
         """
         Terminate audio stream. Users cannot call start() again to detect.
         :return: None
         """
+        self._stop_feature_thread()
         self.stream_in.stop_stream()
         self.stream_in.close()
         self.audio.terminate()